@@ -1,7 +1,11 @@
 from mappy import Aligner, Alignment
+from numba import njit
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from functools import partial
+import os
 from pathlib import Path
 
 from typing import *
@@ -60,38 +64,57 @@ def align(query: str,
         flag is set, None if there is no alignments
     '''
     alignments = aligner.map(query)
+    if best:
+        return next(alignments, None)  # Remaining hits are not generated
 
+    alignments = list(alignments)
     if len(alignments) == 0:
         return
-    if best:
-        return alignments[0]
 
     return alignments
 
 
-def reference_to_query(alignment: Alignment) -> List[int]:
+def align_batch(queries: List[str],
+                aligner: Aligner,
+                best: bool=True,
+                workers: Optional[int]=None) -> List[Union[List[Alignment], 
+                                                           Alignment, None]]:
     '''
-    Maps reference indices to the query indices using cigar string.
+    Aligns multiple query sequences to the reference using a thread pool.
 
-    This function maps every reference base in the alignment to the base(s) in
-    the query sequence. Elements of the list are starting query indices for every
-    reference base. If insertion occured, reference will span multiple query bases
-    (map[pos+1] - map[pos] > 1). If deletion occured there will be no mapped query
-    bases (map[pos+1] - map[pos] = 0). For match or mismatch map[pos+1] - map[pos] = 1.
-    This mapping was generated from cigar string. Last element in this mapping is
-    the exclusive end.
+    Mappy releases the GIL while mapping, so queries are aligned in parallel
+    with the same aligner (the index is shared, not rebuilt per worker). 
+    Results are returned in the same order as the queries.
 
     Args:
-        alignment: mappy.Alignment object representing alignment
+        queries: Query sequences that are going to be aligned
+        aligner: aligner that indexed a reference sequence
+        best: Flag indicating that only the best primary alignment should be
+              returned for every query
+        workers: Number of threads. Default is the number of CPUs.
     Returns:
-        Reference to query base mapping
+        List of alignment results (as returned by align) for every query
     '''
-    ref_len = alignment.r_en - alignment.r_st
-    cigar = alignment.cigar if alignment.strand == 1 else reversed(alignment.cigar)
-    rpos, qpos = 0, alignment.q_st
+    if workers is None:
+        workers = os.cpu_count()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(align, aligner=aligner, best=best), 
+                                 queries))
+
+
+@njit(nogil=True, cache=True)
+def _reference_to_query(cigar_lens: np.ndarray,
+                        cigar_ops: np.ndarray,
+                        q_st: int,
+                        ref_to_query: np.ndarray) -> None:
+    '''
+    Fills reference to query mapping for the given cigar operations.
+    '''
+    rpos, qpos = 0, q_st
 
-    ref_to_query = np.empty((ref_len + 1,), dtype=np.uint32)
-    for l, op in cigar:
+    for k in range(cigar_ops.shape[0]):
+        l, op = cigar_lens[k], cigar_ops[k]
         if op == 0 or op == 7 or op == 8:  # Match or mismatch
             for i in range(l):
                 ref_to_query[rpos + i] = qpos + i
@@ -108,4 +131,43 @@ def reference_to_query(alignment: Alignment) -> List[int]:
 
     ref_to_query[rpos] = qpos  # Add the last one (excluded end)
 
-    return ref_to_query
\ No newline at end of file
+
+def reference_to_query(alignment: Alignment,
+                       out: Optional[np.ndarray]=None) -> np.ndarray:
+    '''
+    Maps reference indices to the query indices using cigar string.
+
+    This function maps every reference base in the alignment to the base(s) in
+    the query sequence. Elements of the list are starting query indices for every
+    reference base. If insertion occured, reference will span multiple query bases
+    (map[pos+1] - map[pos] > 1). If deletion occured there will be no mapped query
+    bases (map[pos+1] - map[pos] = 0). For match or mismatch map[pos+1] - map[pos] = 1.
+    This mapping was generated from cigar string. Last element in this mapping is
+    the exclusive end.
+
+    If out buffer is given, mapping is written into its first ref_len + 1
+    elements and a view of that part is returned. This allows reusing one
+    buffer (sized for the longest alignment) across many alignments.
+
+    Args:
+        alignment: mappy.Alignment object representing alignment
+        out: Optional 1D uint32 buffer with at least ref_len + 1 elements
+    Returns:
+        Reference to query base mapping
+    '''
+    ref_len = alignment.r_en - alignment.r_st
+    cigar = np.asarray(alignment.cigar, dtype=np.int32).reshape(-1, 2)
+    if alignment.strand != 1:
+        cigar = cigar[::-1]  # Reversed view, no copy
+
+    if out is None:
+        ref_to_query = np.empty((ref_len + 1,), dtype=np.uint32)
+    elif out.dtype != np.uint32 or out.ndim != 1:
+        raise ValueError('Output buffer must be one-dimensional uint32 array.')
+    elif out.shape[0] < ref_len + 1:
+        raise ValueError(f'Output buffer too small: {out.shape[0]} < {ref_len + 1}.')
+    else:
+        ref_to_query = out[:ref_len + 1]
+    _reference_to_query(cigar[:, 0], cigar[:, 1], alignment.q_st, ref_to_query)
+
+    return ref_to_query
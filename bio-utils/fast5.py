@@ -1,13 +1,32 @@
+from ont_fast5_api.compression_settings import raise_missing_vbz_error_read
 from ont_fast5_api.fast5_file import Fast5File
 from ont_fast5_api.fast5_interface import get_fast5_file
 from ont_fast5_api.fast5_read import Fast5Read
+from numba import njit
 import numpy as np
 
+from dataclasses import dataclass
 from pathlib import Path
 
 from typing import *
 
 
+@dataclass
+class ReadBundle:
+    fastq: Optional[str]
+    block_stride: Optional[int]
+    move_table: Optional[np.ndarray]
+    raw_start_index: Optional[int]
+
+
+@dataclass
+class ReadMetadata:
+    read_id: str
+    offset: float
+    scale: float
+    sampling_rate: float
+
+
 def get_reads(path: Union[str, Path], 
               mode='r') -> Generator[Union[Fast5Read, Fast5File], None, None]:
     '''Retrieves all reads stored in FAST5 file.
@@ -30,18 +49,110 @@ def get_reads(path: Union[str, Path],
         yield from f5.get_reads()
 
 
-def get_raw_signal(read: Fast5Read, continuous: bool=True) -> np.ndarray:
+def _signal_offset(read: Fast5Read) -> int:
+    dataset = read.handle.get(read.raw_dataset_name)
+    if dataset is None:
+        return 0
+
+    offset = dataset.id.get_offset()  # None for chunked datasets
+    if offset is None and dataset.chunks is not None \
+            and dataset.id.get_num_chunks() > 0:
+        offset = dataset.id.get_chunk_info(0).byte_offset
+
+    return offset if offset is not None else 0
+
+
+def iter_reads_bulk(path: Union[str, Path], 
+                    mode='r') -> Generator[Union[Fast5Read, Fast5File], 
+                                           None, None]:
+    '''Retrieves all reads stored in FAST5 file ordered by signal location.
+
+    Same as get_reads, but reads are ordered by the location of their signal
+    in the file. Signals are then read sequentially instead of randomly 
+    accessing the file, which is considerably faster for multi FAST5 files.
+
+    Args:
+        path: Path to the FAST5 file.
+        mode: Mode for FAST5 file opening.
+    
+    Returns:
+        Generator of all reads present in the FAST5 file, or the FAST5 file 
+        itself.
+    '''
+    if isinstance(path, Path):
+        path = str(path)
+
+    with get_fast5_file(path, mode) as f5:
+        reads = list(f5.get_reads())
+        reads.sort(key=_signal_offset)
+
+        yield from reads
+
+
+def _buffer_view(buffer: np.ndarray, 
+                 dtype: np.dtype, 
+                 size: int, 
+                 name: str) -> np.ndarray:
+    if buffer.ndim != 1 or buffer.dtype != dtype \
+            or not buffer.flags.c_contiguous:
+        raise ValueError(f'{name} must be one-dimensional C-contiguous '
+                         f'{np.dtype(dtype).name} array.')
+    if buffer.shape[0] < size:
+        raise ValueError(f'{name} too small: {buffer.shape[0]} < {size}.')
+
+    return buffer[:size]
+
+
+def get_raw_signal(read: Fast5Read, 
+                   continuous: bool=True,
+                   buffer: Optional[np.ndarray]=None,
+                   out: Optional[np.ndarray]=None) -> np.ndarray:
     '''
     Retrives signal from the fast5 file.
 
+    Raw levels are read directly from the HDF5 dataset into the buffer, 
+    avoiding intermediate copies. If the signal is continuous, levels are 
+    converted to pA into the out array. Both buffer and out (sized for the 
+    longest read) can be reused across many reads. Returned signal is a view
+    of buffer (discrete) or out (continuous), so it is overwritten when they
+    are reused.
+
     Args:
         read: Fast5 read
         continuous: Flag indicating if returned signal should be discrete or
                     continuous
+        buffer: Optional 1D int16 buffer for raw levels, must be at least as
+                long as the signal
+        out: Optional 1D float32 buffer for the continuous signal, must be at
+             least as long as the signal
     Returns:
         Signal for the given read
     '''
-    return read.get_raw_data(scale=continuous)
+    dataset = read.handle[read.raw_dataset_name]
+    n_samples = dataset.shape[0]
+
+    if buffer is None:
+        raw = np.empty((n_samples,), dtype=dataset.dtype)
+    else:
+        raw = _buffer_view(buffer, dataset.dtype, n_samples, 'Buffer')
+    try:
+        dataset.read_direct(raw)
+    except OSError as err:
+        raise_missing_vbz_error_read(err)
+
+    if not continuous:
+        return raw
+
+    if out is None:
+        signal = np.empty((n_samples,), dtype=np.float32)
+    else:
+        signal = _buffer_view(out, np.float32, n_samples, 'Output buffer')
+
+    offset, scale = get_offset_scale(read)
+    np.add(raw, offset, out=signal)
+    signal *= scale
+
+    return signal
 
 
 def get_fastq(read: Fast5Read) -> Optional[str]:
@@ -127,6 +238,47 @@ def get_move_table(read: Fast5Read) -> Optional[np.ndarray]:
     return read.get_analysis_dataset(bc_analysis, 'BaseCalled_template/Move')
 
 
+def get_read_bundle(read: Fast5Read) -> ReadBundle:
+    '''
+    Retrieves all basecall data needed for signal mapping in one pass.
+
+    This function is equivalent to calling get_fastq, get_block_stride, 
+    get_move_table and get_raw_start_index, but the latest analyses are looked
+    up only once per read.
+
+    Args:
+        read: FAST5 read
+    Returns:
+        ReadBundle object with FASTQ string, block stride, move table and raw
+        start index. Fields are None if the corresponding data is not present
+    '''
+    fastq, block_stride, move_table, raw_start_index = None, None, None, None
+
+    bc_analysis = read.get_latest_analysis('Basecall_1D')
+    if bc_analysis is not None:
+        fastq = read.get_analysis_dataset(bc_analysis, 
+                                          'BaseCalled_template/Fastq')
+        move_table = read.get_analysis_dataset(bc_analysis, 
+                                               'BaseCalled_template/Move')
+        bc_summary = read.get_summary_data(bc_analysis)
+        block_stride = bc_summary['basecall_1d_template']['block_stride']
+
+    segmentation = read.get_latest_analysis('Segmentation')
+    if segmentation is not None:
+        summary = read.get_summary_data(segmentation)
+        raw_start_index = summary['segmentation']['first_sample_template']
+
+    return ReadBundle(fastq, block_stride, move_table, raw_start_index)
+
+
+def _offset_scale(channel_info: Dict[str, Any]) -> Tuple[float, float]:
+    digitisation = channel_info['digitisation']
+    rng = channel_info['range']
+    scale = rng / digitisation
+
+    return channel_info['offset'], scale
+
+
 def get_offset_scale(read: Fast5Read) -> Tuple[float, float]:
     '''
     Retrieves offset and scale for the given read.
@@ -139,13 +291,27 @@ def get_offset_scale(read: Fast5Read) -> Tuple[float, float]:
     Returns:
         Tuple of offset and scale for the given read
     '''
-    channel_info = read.get_channel_info()
+    return _offset_scale(read.get_channel_info())
 
-    digitisation = channel_info['digitisation']
-    rng = channel_info['range']
-    scale = rng / digitisation
 
-    return channel_info['offset'], scale
+def get_read_metadata(read: Fast5Read) -> ReadMetadata:
+    '''
+    Retrieves channel metadata for the given read.
+
+    All channel attributes are read from the FAST5 file at once, so this 
+    function should be preferred over repeated calls to get_offset_scale when
+    multiple attributes are needed.
+
+    Args:
+        read: FAST5 read
+    Returns:
+        ReadMetadata object with read id, offset, scale and sampling rate
+    '''
+    channel_info = read.get_channel_info()
+    offset, scale = _offset_scale(channel_info)
+
+    return ReadMetadata(read.read_id, offset, scale, 
+                        channel_info['sampling_rate'])
 
 
 def sequence_to_signal(move_table: np.ndarray,
@@ -165,8 +331,8 @@ def sequence_to_signal(move_table: np.ndarray,
     Returns:
         Sequence-to-signal mapping
     '''
-    move_table = np.append(move_table, 1)
-    return move_table.nonzero()[0] * block_stride + raw_start_idx
+    move_table = np.asarray(move_table).reshape(-1)
+    return _sequence_to_signal(move_table, raw_start_idx, block_stride)
 
 
 def parse_fastq(fastq: str) -> Tuple[str, np.ndarray]:
@@ -183,11 +349,51 @@ def parse_fastq(fastq: str) -> Tuple[str, np.ndarray]:
     data = fastq.strip().split('\n')
 
     sequence = data[1]
-    qualities = np.ndarray([ord(c) - 33 for c in data[3]], dtype=np.uint8)
+    qualities = np.frombuffer(data[3].encode('ascii'), dtype=np.uint8)
+    qualities = qualities - np.uint8(33)
 
     return sequence, qualities
 
 
+@njit(nogil=True, cache=True)
+def _sequence_to_signal(move_table: np.ndarray,
+                        raw_start_idx: int,
+                        block_stride: int) -> np.ndarray:
+    n_bases = 1  # Last element is the exclusive end
+    for i in range(move_table.shape[0]):
+        if move_table[i] != 0:
+            n_bases += 1
+
+    seq_to_signal = np.empty(n_bases, dtype=np.int64)
+    k = 0
+    for i in range(move_table.shape[0]):
+        if move_table[i] != 0:
+            seq_to_signal[k] = i * block_stride + raw_start_idx
+            k += 1
+    seq_to_signal[k] = move_table.shape[0] * block_stride + raw_start_idx
+
+    return seq_to_signal
+
+
+def _median(a: np.ndarray) -> float:
+    '''
+    Computes median using in-place partitioning (quickselect).
+
+    Unlike np.median, no copy of the array is made, so the given array is 
+    reordered. Median of an empty array is NaN (same as np.median).
+    '''
+    if a.size == 0:
+        return np.nan
+
+    k = a.size // 2
+    if a.size % 2 == 1:
+        a.partition(k)
+        return a[k]
+
+    a.partition((k - 1, k))
+    return (a[k - 1] + a[k]) / 2
+
+
 def normalize_mad(signal: np.ndarray,
                   scale_factor: Optional[float]=1.4826) -> np.ndarray:
     '''Performs signal normalization using median absolute deviation.
@@ -201,13 +407,51 @@ def normalize_mad(signal: np.ndarray,
     Args:
         signal: Signal to be normalized.
         scale_factor: Scale factor (default: 1.4826).
+    Returns:
+        Normalized signal as float32 array.
     '''
     if scale_factor is None:
         scale_factor = 1
 
-    med = np.median(signal)
-    shifted = signal - med
-    mad = np.median(np.abs(shifted))
+    signal = np.asarray(signal)
+    shifted = np.empty(signal.shape, dtype=np.float32)
+
+    # Median is computed on the float32 copy, so the signal is shifted in the
+    # same precision (otherwise rounding error would produce a non-zero MAD)
+    np.copyto(shifted, signal, casting='unsafe')
+    med = _median(shifted.reshape(-1))
+    np.copyto(shifted, signal, casting='unsafe')
+    shifted -= med
+
+    mad = _median(np.abs(shifted).reshape(-1))
+    shifted *= 1. / (scale_factor * mad)
+
+    return shifted
 
-    return shifted / (scale_factor * mad)
 
+def preprocess_read(signal: np.ndarray,
+                    move_table: np.ndarray,
+                    raw_start_idx: int,
+                    block_stride: int,
+                    scale_factor: Optional[float]=1.4826
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    '''Normalizes signal and maps basecalled sequence to the signal.
+
+    This function is equivalent to calling normalize_mad and 
+    sequence_to_signal. Both steps release the GIL for most of their work 
+    (NumPy partitioning and compiled move table scan), so reads can be 
+    processed in a thread pool.
+
+    Args:
+        signal: Signal to be normalized.
+        move_table: Move table
+        raw_start_idx: Index for the first signal point
+        block_stride: Block size
+        scale_factor: Scale factor (default: 1.4826).
+    Returns:
+        Normalized signal as float32 array and sequence-to-signal mapping
+    '''
+    normalized = normalize_mad(signal, scale_factor)
+    seq_to_signal = sequence_to_signal(move_table, raw_start_idx, block_stride)
+
+    return normalized, seq_to_signal
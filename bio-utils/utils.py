@@ -1,5 +1,7 @@
-from Bio import SeqIO
+from mappy import fastx_read
+import numpy as np
 
+from multiprocessing import Pool
 from pathlib import Path
 import re
 
@@ -40,39 +42,142 @@ def get_files(path: Union[Path, str],
         yield from files
 
 
-MotifPositions = dict[str, Tuple[Set[int], Set[int]]]
+def list_files(path: Union[Path, str],  
+               extension: str,
+               recursive: bool=False) -> List[Path]:
+    '''
+    Returns sorted list of files in the root path that match the given 
+    extension.
+
+    Same as get_files, but all files are collected at once and sorted, so they
+    can be efficiently distributed to the pool of workers in a stable order.
+
+    Args:
+        path: Root path or path to the file.
+        extension: Extension to be searched for.
+        recursive: Flag to indicate that the search should be performed 
+                   recursively.
+    Returns:
+        Sorted list of all files which path ends with the give extension.
+    '''
+    return sorted(get_files(path, extension, recursive))
+
+
+_IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': '[AG]', 'Y': '[CT]', 'S': '[CG]', 'W': '[AT]', 'K': '[GT]', 
+    'M': '[AC]', 'B': '[CGT]', 'D': '[AGT]', 'H': '[ACT]', 'V': '[ACG]', 
+    'N': '[ACGT]'
+}
+
+
+def _motif_pattern(motif: str) -> Pattern[bytes]:
+    '''
+    Converts motif with IUPAC ambiguity codes to the compiled regex pattern.
+
+    Ambiguous bases are expanded to character classes (e.g. CCWGG becomes
+    CC[AT]GG), or to their bases inside an existing character class (e.g.
+    C[WG]G becomes C[ATG]G). Other regex syntax is kept as is. Pattern is 
+    upper case and should be matched against upper case sequence, so regex 
+    engine can use fast literal prefix search instead of case folding at every
+    position.
+
+    Args:
+        motif: Motif (regex) consisting of IUPAC nucleotide codes.
+    Returns:
+        Compiled regex pattern for the given motif.
+    '''
+    pattern, in_class = [], False
+    for c in motif.upper():
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c.isalpha():
+            if c not in _IUPAC:
+                raise ValueError(f'Invalid base in motif: {c}.')
+            c = _IUPAC[c].strip('[]') if in_class else _IUPAC[c]
+
+        pattern.append(c)
+
+    return re.compile(''.join(pattern).encode())
+
+
+_COMPLEMENT = bytes.maketrans(b'ACGTURYSWKMBDHVNacgturyswkmbdhvn', 
+                              b'TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn')
+
+
+def _scan_contig(args: Tuple[str, str, Pattern[bytes], int]
+                 ) -> Tuple[str, np.ndarray, np.ndarray]:
+    '''
+    Finds motif positions on both strands of a single contig.
+    '''
+    contig, seq, pattern, rel_idx = args
+    seq = seq.upper().encode()
+    length = len(seq)
+
+    fwd_pos = np.fromiter((m.start() + rel_idx 
+                           for m in pattern.finditer(seq)), 
+                          dtype=np.int64)
+
+    rev_seq = seq.translate(_COMPLEMENT)[::-1]
+    rev_pos = np.fromiter((m.start() for m in pattern.finditer(rev_seq)),
+                          dtype=np.int64)
+    # Matches are found in order, so mapping reverse strand matches to the
+    # forward coordinates only needs flipping to keep positions sorted
+    rev_pos = (length - rel_idx - 1) - rev_pos[::-1]
+
+    return contig, fwd_pos, rev_pos
+
+
+MotifPositions = dict[str, Tuple[np.ndarray, np.ndarray]]
 def build_reference_idx(path: Union[Path, str], 
                         motif: str,
-                        rel_idx: int) -> MotifPositions:
+                        rel_idx: int,
+                        workers: Optional[int]=None) -> MotifPositions:
     '''
     Generates position for specific motif.
 
     This function generates position dictionary for specific motif and relative 
     index (specific base in the motif). Positions are stored separately for forward 
     and reverse strand. Keys to the dictionary are seuqnce names that are 
-    present in the FASTA file.
+    present in the FASTA file. Motif can contain IUPAC ambiguity codes and 
+    matching is case insensitive. Contigs are scanned in parallel using a pool
+    of processes, unless workers is 1. On platforms that spawn processes 
+    (macOS, Windows), calling script must guard its entry point with 
+    `if __name__ == '__main__':` when more than one worker is used.
 
     Args:
         path: Path to the FASTA file.
-        motif: Motif to be searched for in the sequences.
+        motif: Motif (regex) to be searched for in the sequences. Letters 
+               must be IUPAC nucleotide codes.
         rel_idx: Index relative to the start of the motif.
+        workers: Number of processes. Default is the number of CPUs. If 1,
+                 contigs are scanned in the calling process.
     Returns:
         Dictionary of [seq_name, positions] elements in which positions are 
-        defined as tuple of position on forward and on reverse strand
+        defined as tuple of sorted int64 arrays of positions on forward and on
+        reverse strand
+    Raises:
+        FileNotFoundError: If the FASTA file does not exist.
     '''
-    positions = OrderedDict()
+    # mappy silently yields no records for a file it cannot open
+    if not Path(path).is_file():
+        raise FileNotFoundError(f'Reference file not found: {path}.')
 
-    for record in SeqIO.parse(path, 'fasta'):
-        contig = record.name
-        length = len(record.seq)
+    positions = OrderedDict()
 
-        fwd_pos = {m.start() + rel_idx for m in re.finditer(motif, str(record.seq), re.I)}
+    pattern = _motif_pattern(motif)
 
-        def pos_for_rev(i):
-            return length - (i + rel_idx) - 1
-        rev_pos = {pos_for_rev(m.start()) 
-                   for m in re.finditer(motif, str(record.seq.reverse_complement()), re.I)}
+    contigs = ((name, seq, pattern, rel_idx) 
+               for name, seq, _ in fastx_read(str(path)))
 
-        positions[contig] = (fwd_pos, rev_pos)
+    if workers == 1:
+        for contig, fwd_pos, rev_pos in map(_scan_contig, contigs):
+            positions[contig] = (fwd_pos, rev_pos)
+    else:
+        with Pool(workers) as pool:
+            for contig, fwd_pos, rev_pos in pool.imap(_scan_contig, contigs):
+                positions[contig] = (fwd_pos, rev_pos)
 
-    return positions
\ No newline at end of file
+    return positions